@@ -2,14 +2,32 @@
 #
 # invoke with py devserver.py path_to_mainpage
 
-from http.server import HTTPServer, SimpleHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from urllib.parse import urlparse, unquote_plus
 import ssl, json, threading, webbrowser, time, sys, os, stat, datetime, shutil, subprocess, re, stat
+import concurrent.futures, queue, functools, types, signal
 import tkinter as tk
 import tkinter.filedialog as fd
 
 rootdir = os.getcwd()
 
+# the TLS context is made once, when the module is loaded. If the pem files
+# are not available, context is None and the server runs plain http.
+try:
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(
+        certfile=os.path.join(os.path.dirname(__file__), "localhost.pem"),
+        keyfile=os.path.join(os.path.dirname(__file__), "localhost-key.pem"),
+    )
+    context.check_hostname = False
+    # TLS 1.3 only has AES-GCM & ChaCha20 ciphers, which are fast with
+    # hardware AES; browsers all support it.
+    context.minimum_version = ssl.TLSVersion.TLSv1_3
+    # session tickets are on by default, so reconnecting browsers can skip a
+    # full handshake
+except OSError:
+    context = None
+
 
 def abspath(path):
     """
@@ -21,12 +39,67 @@ def abspath(path):
     Returns:
        the absolute path.
     """
+    return _abspath(rootdir, path)
+
+
+@functools.lru_cache(maxsize=4096)
+def _abspath(rootdir, path):
+    # the rootdir is part of the cache key, so changing it is safe
     return os.path.normpath(os.path.join(rootdir, path))
 
 
+# a short-lived cache of stat results, shared by all the server threads,
+# so that a page polling getstats doesn't stat the file every time.
+_stat_cache = {}
+_stat_cache_lock = threading.Lock()
+_stat_cache_ttl = 1.0  # seconds
+_stat_cache_size = 4096
+
+
+def cached_stat(path):
+    """
+    os.stat with a short-lived cache.
+    Parameters:
+        path - an absolute path
+
+    Returns:
+        the stat result, which may be up to _stat_cache_ttl seconds old.
+    """
+    now = time.monotonic()
+    with _stat_cache_lock:
+        entry = _stat_cache.get(path)
+    if entry and now - entry[0] < _stat_cache_ttl:
+        return entry[1]
+    statinfo = os.stat(path)
+    with _stat_cache_lock:
+        if len(_stat_cache) >= _stat_cache_size:
+            _stat_cache.clear()
+        _stat_cache[path] = (now, statinfo)
+    return statinfo
+
+
+def forget_stat(path):
+    # drops a cached stat result, when the server itself changes the file
+    with _stat_cache_lock:
+        _stat_cache.pop(abspath(path), None)
+
+
+# a thread pool for running independent file operations side by side
+pool = concurrent.futures.ThreadPoolExecutor()
+
+
+# json for route results, with compact separators, which makes the output
+# smaller and a little quicker to produce. The results are plain lists &
+# dicts, so the circular reference check is skipped too.
+tojson = json.JSONEncoder(separators=(",", ":"), check_circular=False).encode
+
+
 # The router:
 
-routes = {}
+# route functions are added to _routes by the decorator; everything else
+# reads them through the read-only routes view
+_routes = {}
+routes = types.MappingProxyType(_routes)
 
 
 def route(f):
@@ -51,7 +124,7 @@ def route(f):
             raise e
 
     routename = "/" + f.__name__.replace("_", "/")
-    routes[routename] = lambda handler, *args: trycatch(f, handler, *args)
+    _routes[routename] = lambda handler, *args: trycatch(f, handler, *args)
     return f
 
 
@@ -70,9 +143,8 @@ def api_fs_readtext(handler, path, content_type="text/plain"):
     Response:
         returns the text file contents.
     """
-    with open(abspath(path), "rb") as f:  # open as bytes to avoid encoding
-        contents = f.read()  # as text/plain
-    handler.respond(200, content_type, contents)
+    # sent as bytes to avoid encoding as text/plain
+    handler.respond_file(200, content_type, abspath(path))
 
 
 @route
@@ -88,9 +160,7 @@ def api_fs_readbinary(handler, path, content_type="application/octet-stream"):
 
     There's not much difference between this and the readtext function.
     """
-    with open(abspath(path), "rb") as f:
-        contents = f.read()
-    handler.respond(200, content_type, contents)
+    handler.respond_file(200, content_type, abspath(path))
 
 
 @route
@@ -103,19 +173,25 @@ def api_fs_readfolder(handler, path):
     """
     dirlist = []
     dirpath = abspath(path)
-    for f in os.listdir(dirpath):
-        fpath = os.path.join(dirpath, f)
-        if os.path.isfile(fpath):
-            dirlist.append({"name": f, "path": fpath, "type": "file"})
-        elif os.path.isdir(fpath):
-            dirlist.append({"name": f, "path": fpath, "type": "folder"})
-        else:
-            dirlist.append({"name": f, "path": fpath, "type": "other"})
-    handler.respond(200, "application/json", json.dumps(dirlist))
+    # scandir entries know their type from the directory listing, so
+    # there's no stat call per entry. Where the filesystem doesn't report
+    # the type, each entry does one stat and caches it for is_file & is_dir.
+    with os.scandir(dirpath) as entries:
+        for f in entries:
+            if f.is_file():
+                dirlist.append({"name": f.name, "path": f.path, "type": "file"})
+            elif f.is_dir():
+                dirlist.append({"name": f.name, "path": f.path, "type": "folder"})
+            else:
+                dirlist.append({"name": f.name, "path": f.path, "type": "other"})
+    handler.respond(200, "application/json", tojson(dirlist))
 
 
 def todatestr(ts):
-    return datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%dT%H:%M:%S.%f%z")
+    # an ISO 8601 UTC date string, which javascript's Date can parse
+    return datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc).isoformat(
+        timespec="microseconds"
+    )
 
 
 @route
@@ -130,18 +206,27 @@ def api_fs_getstats(handler, path):
         returns a json object {path, type, accessed, modified, created}.
     """
     path = abspath(path)
-    statinfo = os.stat(path)
+    statinfo = cached_stat(path)
     statdict = {}
     statdict["path"] = path
     statdict["type"] = "folder" if stat.S_ISDIR(statinfo.st_mode) else "file"
     statdict["accessed"] = todatestr(statinfo.st_atime)
     statdict["modified"] = todatestr(statinfo.st_mtime)
+    # st_birthtime only exists on some platforms; elsewhere use st_ctime
+    statdict["created"] = todatestr(
+        getattr(statinfo, "st_birthtime", statinfo.st_ctime)
+    )
+    handler.respond(200, "application/json", tojson(statdict))
+
+
+def deletefile(p):
+    # deletes a file, returning whether it worked
     try:
-        statdict["created"] = statinfo.st_birthtime
+        os.remove(p)
+        forget_stat(p)
+        return True
     except:
-        statdict["created"] = statinfo.st_ctime
-    statdict["created"] = todatestr(statdict["created"])
-    handler.respond(200, "application/json", json.dumps(statdict))
+        return False
 
 
 @route
@@ -155,14 +240,15 @@ def api_fs_deletefile(handler, paths):
     Returns:
         array of true/false whether the delete succeeded or not.
     """
-    result = []
-    for p in paths:
-        try:
-            os.remove(p)
-            result.append(True)
-        except:
-            result.append(False)
-    handler.respond(200, "application/json", json.dumps(result))
+    # each distinct file is deleted once, side by side with the others. A
+    # repeat of a path gets False, as deleting it a second time would.
+    first = {}  # file -> index of the first path naming it
+    for i, p in enumerate(paths):
+        first.setdefault(os.path.normcase(abspath(p)), i)
+    firsts = list(first.values())
+    deleted = dict(zip(firsts, pool.map(deletefile, [paths[i] for i in firsts])))
+    result = [deleted.get(i, False) for i in range(len(paths))]
+    handler.respond(200, "application/json", tojson(result))
 
 
 @route
@@ -188,6 +274,7 @@ def api_fs_deletefolder(handler, path):
     """
     os.chmod(path, stat.S_IWUSR) # windows likes to make it hard to remove folders
     os.rmdir(path)
+    forget_stat(path)
     handler.respond(200)
 
 
@@ -197,22 +284,56 @@ def api_fs_writefile(handler, args):
     write a file
 
     Parameters:
-        args - an object {path, contents} describing the file to write
+        args - a MultipartForm {path, contents} describing the file to write.
+            The path comes first, so the contents can be streamed from the
+            request straight into the file.
 
     """
-    args["path"] = args["path"].decode("utf-8")
-    with open(abspath(args["path"]), "wb") as f:
-        f.write(args["contents"])
+    path = args["path"].read().decode("utf-8")
+    with open(abspath(path), "wb") as f:
+        shutil.copyfileobj(args["contents"], f, handler.chunk_size)
+    forget_stat(path)
     # and respond
     handler.respond(200)
 
 
+def copy_dest(a):
+    # the file that a copy {src, dest} writes; dest can be a folder
+    dest = a["dest"]
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(a["src"]))
+    return dest
+
+
+def copy_one_file(src, dest):
+    # copies a file to dest, which copy_dest has worked out. copyfile only
+    # copies the data, which it does in the kernel where it can, and skips
+    # the permission bits that copy would also set.
+    shutil.copyfile(src, dest)
+    forget_stat(dest)
+
+
 @route
 def api_fs_copyfile(handler, args):
     if type(args) not in (list, tuple):
         args = (args,)
-    for a in args:
-        shutil.copy(a["src"], a["dest"])
+    srcs = [a["src"] for a in args]
+    dests = [copy_dest(a) for a in args]
+    written = [os.path.normcase(abspath(d)) for d in dests]
+    read = [os.path.normcase(abspath(s)) for s in srcs]
+    if len(set(written)) == len(written) and not set(written) & set(read):
+        # the copies are independent, so run them side by side. All of them
+        # are tried, so one failing doesn't stop the others; once they have
+        # all finished, the first error (in request order) is raised.
+        copies = [pool.submit(copy_one_file, s, d) for s, d in zip(srcs, dests)]
+        concurrent.futures.wait(copies)
+        for c in copies:
+            c.result()
+    else:
+        # a copy writes a file that another copy reads or writes, so they
+        # have to be done in order, stopping at the first error
+        for src, dest in zip(srcs, dests):
+            copy_one_file(src, dest)
     handler.respond(200)
 
 
@@ -222,61 +343,273 @@ def api_fs_relativepath(handler, path):
     handler.respond(200, "text/plain", os.path.relpath(path, rootdir))
 
 
-class TKRoot:
-    def __init__(self):
-        self.root = None
+# Tk has to be used from the thread that created it, and starting it up is
+# slow, so the dialogs all run on one daemon thread which keeps a hidden
+# root window. It is started the first time a dialog is wanted, and server
+# threads pass it work through _tk_queue.
+_tk_queue = queue.Queue()
+_tk_thread = None
+_tk_lock = threading.Lock()
+
 
-    def __enter__(self):
-        self.root = tk.Tk()
-        self.root.attributes("-alpha", 0.0)
-        self.root.lift()
-        return self.root
+def _tk_stopped(e):
+    # the Tk thread has stopped, or couldn't start: fail the waiting dialogs
+    # with e, and let the next one start a new thread
+    global _tk_thread
+    with _tk_lock:
+        _tk_thread = None
+        while not _tk_queue.empty():
+            _tk_queue.get()[2].set_exception(e)
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        self.root.destroy()
+
+def _tk_loop():
+    try:
+        root = tk.Tk()
+        root.attributes("-alpha", 0.0)
+        root.withdraw()
+
+        def poll():
+            # run any dialogs that have been asked for, then check again
+            # shortly. Every dialog gets a result or an exception, and poll
+            # is always rescheduled, so no request is left waiting.
+            try:
+                while not _tk_queue.empty():
+                    func, args, future = _tk_queue.get()
+                    if future.set_running_or_notify_cancel():
+                        try:
+                            root.deiconify()
+                            root.lift()
+                            future.set_result(func(parent=root, **args))
+                            root.withdraw()
+                        except Exception as e:
+                            if not future.done():
+                                future.set_exception(e)
+            finally:
+                root.after(50, poll)
+
+        poll()
+        root.mainloop()
+        e = RuntimeError("the Tk thread has stopped")
+    except Exception as error:
+        e = error  # e.g. no display
+    _tk_stopped(e)
+
+
+def tk_call(func, **args):
+    """
+    calls a tkinter dialog function on the Tk thread.
+    Parameters:
+        func - the dialog function, e.g. fd.askopenfilename
+        args - keyword arguments for func. The parent is supplied.
+
+    Returns:
+        whatever func returns, once the dialog is closed.
+    """
+    global _tk_thread
+    with _tk_lock:
+        if _tk_thread is None:
+            _tk_thread = threading.Thread(target=_tk_loop, daemon=True)
+            _tk_thread.start()
+        future = concurrent.futures.Future()
+        _tk_queue.put((func, args, future))
+    return future.result()
 
 
 @route
 def api_ui_chooseopenfile(handler, args):
     # args are title, initialdir, initialfile, filetypes [(label, pattern), (label, patterns), ...],
     # defaultextension
-    with TKRoot() as root:
-        fname = fd.askopenfilename(parent=root, **args)
-        handler.respond(200, "text/plain", fname)
+    fname = tk_call(fd.askopenfilename, **args)
+    handler.respond(200, "text/plain", fname)
 
 
 @route
 def api_ui_choosesavefile(handler, args):
-    with TKRoot() as root:
-        fname = fd.asksaveasfilename(parent=None, **args)
-        handler.respond(200, "text/plain", fname)
+    fname = tk_call(fd.asksaveasfilename, **args)
+    handler.respond(200, "text/plain", fname)
 
 
 @route
 def api_ui_choosefolder(handler, args):
-    with TKRoot() as root:
-        fname = fd.askdirectory(parent=None, **args)
-        handler.respond(200, "text/plain", fname)
+    fname = tk_call(fd.askdirectory, **args)
+    handler.respond(200, "text/plain", fname)
 
 
-_quit_server = False
+# set by api_exit; the main thread waits on it. The handler threads are
+# daemon threads, so they don't hold up the exit.
+_quit_server = threading.Event()
 
 
 @route
 def api_exit(handler):
     handler.respond(204)
-    global _quit_server
-    _quit_server = True
+    handler.wfile.flush()  # send the response before the main thread exits
+    _quit_server.set()
+
+
+# pids of commands started with posix_spawn, which have to be waited for
+# once they exit
+_spawned = []
+_spawned_lock = threading.Lock()
+
+
+def reap_spawned():
+    # collects any spawned commands that have exited, so they don't linger
+    # as zombie processes
+    with _spawned_lock:
+        for pid in _spawned[:]:
+            try:
+                done = os.waitpid(pid, os.WNOHANG)[0]
+            except ChildProcessError:
+                done = pid
+            if done:
+                _spawned.remove(pid)
 
 
 @route
 def api_command(handler, cmd):
-    # cmd could be a string or array of strings
-    subprocess.Popen(cmd)
+    # cmd could be a string or array of strings. It is started, not waited
+    # for; starting it only holds up this request's thread.
+    if hasattr(os, "posix_spawnp"):
+        # posix_spawn avoids fork copying the server's page tables.
+        # Reset the signals python ignores, as Popen does.
+        argv = [cmd] if type(cmd) == str else cmd
+        reap_spawned()
+        pid = os.posix_spawnp(
+            argv[0], argv, os.environ, setsigdef=(signal.SIGPIPE, signal.SIGXFSZ)
+        )
+        with _spawned_lock:
+            _spawned.append(pid)
+    else:
+        subprocess.Popen(cmd)
     handler.respond(200, "text/plain", "done")
 
 
+# the start of every respond header. To stop cacheing, use no-store for
+# extra privacy.
+_response_head = (
+    b"%s %d %s\r\n"
+    b"Server: %s\r\n"
+    b"Date: %s\r\n"
+    b"Cache-Control: no-cache\r\n"
+)
+
+# finds the field name in a multipart Content-Disposition header
+_field_name = re.compile(rb'name="([^"]*)"')
+
+
+class MultipartForm:
+    """
+    the fields of a multipart/form-data request body. The body is read from
+    the request as the fields are used, a chunk at a time, so an upload never
+    has to be held in memory or spooled to disk.
+
+    form[name] moves on to the field called name and returns the form, whose
+    read method then reads that field's contents. Fields must be used in the
+    order they were sent; api.js sends them in the order of the args object.
+    Very basic, doesn't work with filename= fields.
+    """
+
+    def __init__(self, rfile, length, chunk_size):
+        self.rfile = rfile
+        self.remaining = length  # bytes of the body still to be read
+        self.chunk_size = chunk_size
+        # the separator is the first line. Every part, and the end, is
+        # introduced by '\r\n' + separator, so pretend the body starts that way.
+        # buf is a bytearray, so used data can be dropped from the front in place.
+        self.buf = bytearray(b"\r\n")
+        self.fill()
+        while self.buf.find(b"\r\n", 2) < 0:
+            self.fill()
+        self.sep = bytes(self.buf[: self.buf.find(b"\r\n", 2)])
+        # the most of a separator that can hide at the end of buf
+        self.keep = len(self.sep) - 1
+        self.in_part = False  # whether buf starts inside a field's contents
+        self.done = False  # whether the end separator has been reached
+
+    def fill(self):
+        # reads another chunk of the body onto the end of buf
+        chunk = self.rfile.read(min(self.chunk_size, self.remaining))
+        if not chunk:
+            raise ValueError("multipart body ended early")
+        self.remaining -= len(chunk)
+        self.buf += chunk
+
+    def read(self, size=-1):
+        """
+        reads the current field's contents.
+        Parameters:
+            size - the most bytes to return; all the rest of the field if < 0
+
+        Returns:
+            the bytes, or b"" at the end of the field.
+        """
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(self.chunk_size), b""))
+        while self.in_part:
+            end = self.buf.find(self.sep)
+            if end == 0:
+                self.in_part = False
+            elif end > 0 or len(self.buf) > self.keep:
+                n = min(size, end if end > 0 else len(self.buf) - self.keep)
+                with memoryview(self.buf) as mv:
+                    contents = mv[:n].tobytes()
+                del self.buf[:n]
+                return contents
+            else:
+                self.fill()
+        return b""
+
+    def next_part(self):
+        # skips the rest of the current field & reads the next one's headers.
+        # Returns the headers, or None at the end of the body.
+        while self.read(self.chunk_size):
+            pass
+        if self.done:
+            return None
+        # buf starts with a separator, which is followed by '--' at the end
+        while len(self.buf) < len(self.sep) + 2:
+            self.fill()
+        if self.buf[len(self.sep) : len(self.sep) + 2] == b"--":
+            self.done = True
+            return None
+        del self.buf[: len(self.sep) + 2]
+        # the part headers end with a blank line
+        while (end := self.buf.find(b"\r\n\r\n")) < 0:
+            self.fill()
+        meta = bytes(self.buf[:end])
+        del self.buf[: end + 4]
+        self.in_part = True
+        return meta
+
+    def __getitem__(self, key):
+        while (meta := self.next_part()) is not None:
+            # no other dispositions are used.
+            if meta.startswith(b"Content-Disposition: form-data;"):
+                if _field_name.search(meta)[1].decode("utf-8") == key:
+                    return self
+        raise KeyError(key)
+
+    def finish(self):
+        # reads whatever is left of the body
+        while self.next_part() is not None:
+            pass
+        while self.remaining > 0:
+            self.fill()
+            self.buf.clear()
+
+
 class MyHandler(SimpleHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests, which saves a TLS
+    # handshake per request. Every response must send a Content-Length.
+    protocol_version = "HTTP/1.1"
+    # buffer writes to the socket; the buffer is flushed after each request
+    wbufsize = -1
+    # how much of a request body is read at a time
+    chunk_size = 256 * 1024
+    # the Content-Length of the response being sent, if any
+    content_length = None
+
     def do_GET(self):
         urlobj = urlparse(self.path)
         print(urlobj.path)
@@ -285,8 +618,10 @@ class MyHandler(SimpleHTTPRequestHandler):
             if urlobj.query == "":
                 routes[urlobj.path](self)  # dummy args to keep calling simple
             else:
-                query = parse_qs(urlobj.query)
-                args = json.loads(query["args"][0])
+                # the query is just args=<json>, so pick it out directly
+                # rather than having parse_qs build a dict of lists
+                query = urlobj.query.partition("args=")[2].partition("&")[0]
+                args = json.loads(unquote_plus(query))
                 routes[urlobj.path](self, args)
         else:
             # this is fine unless you want cache control
@@ -305,49 +640,108 @@ class MyHandler(SimpleHTTPRequestHandler):
             request_headers = self.headers
             content_length = request_headers["Content-Length"]
             length = int(content_length) if content_length else 0
-            content = self.rfile.read(length)
             if request_headers["Content-Type"] == "multipart/form-data":
-                data = self.decode_multipart(content)
+                form = MultipartForm(self.rfile, length, self.chunk_size)
+                routes[urlobj.path](self, form)
+                # read the rest of the body, so the connection can be reused
+                form.finish()
             elif request_headers["Content-Type"] == "application/json":
+                content = self.rfile.read(length)
                 print(content)
-                data = json.loads(content.decode("utf-8"))
-            routes[urlobj.path](self, data)
+                data = json.loads(content)
+                routes[urlobj.path](self, data)
+            else:
+                # the body hasn't been read, so the connection can't be reused
+                self.close_connection = True
+                self.send_error(415)
+        else:
+            # the body hasn't been read, so the connection can't be reused
+            self.close_connection = True
+            self.send_error(404)
 
     def respond(self, code, content_type=None, contents_b=None):
-        # does the response
-        self.send_response(code)
+        # does the response. The header is filled in from _response_head
+        # rather than built up with send_response & send_header. wfile is
+        # buffered, so the header and a small body go out in one write when
+        # the handler flushes it.
+        contents_b = contents_b or b""
+        if type(contents_b) != bytes:
+            contents_b = contents_b.encode("utf-8")
+        self.log_request(code)
+        head = _response_head % (
+            self.protocol_version.encode(),
+            code,
+            self.responses[code][0].encode(),
+            self.version_string().encode(),
+            self.date_time_string().encode(),
+        )
         if content_type:
+            head += b"Content-type: %s\r\n" % content_type.encode("latin-1")
+        if code != 204:
+            head += b"Content-Length: %d\r\n" % len(contents_b)
+        self.wfile.write(head + b"\r\n")
+        self.wfile.write(contents_b)
+
+    def respond_file(self, code, content_type, path):
+        # like respond, but the contents come from a file, which is copied
+        # to the socket a chunk at a time rather than read into memory.
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(code)
             self.send_header("Content-type", content_type)
-        # to stop cacheing, use no-store for extra privacy
-        self.send_header("Cache-Control", "no-cache")
-        self.end_headers()
-        if contents_b:
-            if type(contents_b) != bytes:
-                contents_b = contents_b.encode("utf-8")
-            else:
-                print("bytes object", content_type)
-            self.wfile.write(contents_b)
-
-    def decode_multipart(self, mp):
-        # decodes the multipart bytes
-        # very basic, doesn't work with filename= fields.
-        seplen = mp.find(b"\r\n") + 2  # the length of the separator string + '\r\n'
-        mp = mp.split(mp[:seplen])[
-            1:
-        ]  # split by separator, and drop the '' at the start
-        # the last of the parts has the end which is -- added
-        mp[-1] = mp[-1][: -(seplen + 2)]
-        # split each part into name & contents
-        data = {}
-        for part in mp:
-            meta, content = part[:-2].split(b"\r\n\r\n", maxsplit=1)
-            if meta.startswith(b"Content-Disposition: form-data;"):
-                key = re.search(b'name="([^"]*)"', meta)[1].decode("utf-8")
-                print(key, len(content))
-                data[key] = content
-            else:
-                pass  # no other dispositions are used.
-        return data
+            self.send_header("Content-Length", str(size))
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.copyfile(f, self.wfile)
+
+    def send_header(self, keyword, value):
+        # remember the Content-Length, so copyfile sends exactly that much
+        if keyword.lower() == "content-length":
+            self.content_length = int(value)
+        super().send_header(keyword, value)
+
+    def copyfile(self, source, outputfile):
+        # copies a file to the response; also used by SimpleHTTPRequestHandler
+        # for static files. sendfile moves the data from the file to the socket
+        # inside the kernel, but it can't be used when the socket is wrapped in
+        # TLS, so then we copy in big chunks.
+        # Exactly the Content-Length that was sent is copied, even if the file
+        # has changed size since, as otherwise the next response on a kept-alive
+        # connection would be garbled. If the file is now shorter, the
+        # connection is closed to end the response.
+        size, self.content_length = self.content_length, None
+        outputfile.flush()
+        try:
+            infd = source.fileno()
+        except (AttributeError, OSError):
+            infd = None  # e.g. the BytesIO of a directory listing
+        if size is None:
+            # no length was sent, so the end of the response is the end of
+            # the connection
+            self.close_connection = True
+            shutil.copyfileobj(source, outputfile, 1024 * 1024)
+            return
+        if (
+            hasattr(os, "sendfile")
+            and infd is not None
+            and not isinstance(self.connection, ssl.SSLSocket)
+        ):
+            offset = source.tell()
+            while size > 0:
+                sent = os.sendfile(self.connection.fileno(), infd, offset, size)
+                if sent == 0:
+                    break
+                offset += sent
+                size -= sent
+        else:
+            while size > 0:
+                chunk = source.read(min(size, 1024 * 1024))
+                if not chunk:
+                    break
+                outputfile.write(chunk)
+                size -= len(chunk)
+        if size > 0:
+            self.close_connection = True
 
 
 if __name__ == "__main__":
@@ -363,33 +757,29 @@ if __name__ == "__main__":
     entryfile = entryfile or "index.html"
     rootdir = os.getcwd()  # just for formatting reasons
 
-    # need to work if pem files are not available and do a different context
-    try:
-        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-        context.load_cert_chain(
-            certfile=os.path.join(os.path.dirname(__file__), "localhost.pem"),
-            keyfile=os.path.join(os.path.dirname(__file__), "localhost-key.pem"),
-        )
-        context.check_hostname = False
-        protocol = "https"
-    except:
-        context = None
-        protocol = "http"
+    protocol = "https" if context else "http"
 
     def start_server():
-        with HTTPServer(address, MyHandler) as httpd:
+        # one thread per connection, so a slow request (a big file, a file
+        # dialog) doesn't hold up the others.
+        with ThreadingHTTPServer(address, MyHandler) as httpd:
+            httpd.daemon_threads = True
             if context:
-                httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
+                # the handshake happens on the connection's first read, in its
+                # own thread, rather than in accept on the server thread.
+                httpd.socket = context.wrap_socket(
+                    httpd.socket, server_side=True, do_handshake_on_connect=False
+                )
             httpd.serve_forever()
 
     server_thread = threading.Thread(target=start_server, daemon=True)
     server_thread.start()
     webbrowser.open_new(f"{protocol}://{address[0]}:{address[1]}/{entryfile}")
 
-    while True:
-        try:
-            time.sleep(1)
-            if _quit_server:
-                sys.exit(0)
-        except:
-            sys.exit(0)
+    try:
+        # wait with a timeout, so ctrl-C still works on windows
+        while not _quit_server.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)